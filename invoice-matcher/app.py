@@ -2,27 +2,54 @@ import os
 import fitz # PyMuPDF
 import pdfplumber
 import io
-from PIL import Image
+import math
+import re
+import functools
+from PIL import Image, ImageDraw, ImageFont
 import google.generativeai as genai
 from dotenv import load_dotenv
-import json
+import orjson
 import streamlit as st
-from fpdf import FPDF
 import base64
+import asyncio
+import hashlib
+import diskcache
+import threading
+import queue
+import faiss
+from sentence_transformers import SentenceTransformer
+from matching import vendors_match
+from report import create_pdf
 
 # --- Configuration ---
-load_dotenv()
+@st.cache_resource
+def configure_gemini():
+    # Streamlit re-executes this script on every interaction; imports are already memoized
+    # in sys.modules, but the .env read and client setup would otherwise repeat each rerun
+    load_dotenv()
+    # Load API key from environment variables
+    genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
+    return genai.types.GenerationConfig(temperature=0)
 
-# Load API key from environment variables
 try:
-    genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
+    GENERATION_CONFIG = configure_gemini()
 except KeyError:
     st.error("FATAL: GOOGLE_API_KEY environment variable not set. Please set it to your Gemini API key.")
     st.stop()
 
+# Cached analyses are keyed by this; bump it whenever the prompts change
+PROMPT_VERSION = b"2"
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+RESPONSE_CACHE_DIR = os.path.join(CACHE_DIR, "gemini")
+RESPONSE_CACHE_TTL = 86400
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+# Cosine similarity above which a previous text-based analysis is reused
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_CANDIDATES = 5
+
 # --- Prompts ---
-TEXT_PROMPT = """
-You are an expert accounts payable specialist. Your task is to analyze the following text content from an invoice and a purchase order and extract key information.
+INVOICE_TEXT_PROMPT = """
+You are an expert accounts payable specialist. Your task is to analyze the following text content from an invoice and extract key information.
 
 From the INVOICE text, extract:
 - Invoice Number
@@ -31,6 +58,19 @@ From the INVOICE text, extract:
 - A list of all line items. Each item should have a 'description', 'quantity', and 'price'.
 - Total Amount
 
+Return your findings ONLY as a single, minified JSON object. The JSON structure must be:
+{
+  "invoice_data": {
+    "invoice_no": "...", "date": "...", "vendor": "...",
+    "items": [{"description": "...", "quantity": 1, "price": 0.00}],
+    "total": 0.00
+  }
+}
+"""
+
+PO_TEXT_PROMPT = """
+You are an expert accounts payable specialist. Your task is to analyze the following text content from a purchase order and extract key information.
+
 From the PURCHASE ORDER text, extract:
 - PO Number
 - Date
@@ -40,11 +80,6 @@ From the PURCHASE ORDER text, extract:
 
 Return your findings ONLY as a single, minified JSON object. The JSON structure must be:
 {
-  "invoice_data": {
-    "invoice_no": "...", "date": "...", "vendor": "...",
-    "items": [{"description": "...", "quantity": 1, "price": 0.00}],
-    "total": 0.00
-  },
   "po_data": {
     "po_no": "...", "date": "...", "vendor": "...",
     "items": [{"description": "...", "quantity": 1, "price": 0.00}],
@@ -54,16 +89,16 @@ Return your findings ONLY as a single, minified JSON object. The JSON structure
 """
 
 IMAGE_PROMPT = """
-You are an expert accounts payable specialist. Your task is to extract key information from the provided document images.
+You are an expert accounts payable specialist. Your task is to extract key information from the provided image. The LEFT half, labeled "INVOICE", is the invoice; the RIGHT half, labeled "PO", is the purchase order.
 
-From the INVOICE image, extract:
+From the INVOICE (left half), extract:
 - Invoice Number
 - Date
 - Vendor Name
 - A list of all line items. Each item should have a 'description', 'quantity', and 'price'.
 - Total Amount
 
-From the PURCHASE ORDER image, extract:
+From the PURCHASE ORDER (right half), extract:
 - PO Number
 - Date
 - Vendor Name
@@ -86,67 +121,339 @@ Return your findings ONLY as a single, minified JSON object. The JSON structure
 """
 
 # --- Gemini API Interaction ---
-def get_gemini_response(payload):
+def get_model_name(payload):
     # Determine the model based on the payload content
-    if any(isinstance(item, Image.Image) for item in payload):
-        model_name = 'gemini-2.5-pro'
-    else:
-        model_name = 'gemini-2.5-pro'
-
-    model = genai.GenerativeModel(model_name)
+    if any(isinstance(item, Image.Image) or (isinstance(item, dict) and item.get("mime_type", "").startswith("image/")) for item in payload):
+        return 'gemini-2.5-pro'
+    # Plain extracted text is well within Flash's capability at far lower latency and cost
+    return 'gemini-2.5-flash'
+
+@st.cache_resource
+def get_gemini_model(model_name):
+    return genai.GenerativeModel(model_name)
+
+@st.cache_resource
+def get_event_loop():
+    # A single long-lived loop, so the async gRPC channel behind the cached models
+    # stays usable across reruns (asyncio.run would close it after every call)
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+async def analyze_doc(model, payload, label, events):
+    # Runs on the background loop, so UI updates go through `events` instead of st.*
+    chunks = []
     try:
-        generation_config = genai.types.GenerationConfig(temperature=0)
-        response = model.generate_content(payload, generation_config=generation_config)
+        response = await model.generate_content_async(payload, generation_config=GENERATION_CONFIG, stream=True)
+        # Stream the reply so progress shows up while the JSON is still being generated
+        async for chunk in response:
+            chunks.append(chunk.text)
+            events.put(("progress", label, f"{label}: received {sum(len(c) for c in chunks)} characters..."))
         # Clean up the response text before parsing
-        json_text = response.text.strip()
+        json_text = "".join(chunks).strip()
         # Handle cases where the model might return the JSON in a code block
         if json_text.startswith('```json'):
             json_text = json_text[7:-3].strip()
         elif json_text.startswith('```'):
             json_text = json_text[3:-3].strip()
-        
-        return json.loads(json_text)
-    except json.JSONDecodeError:
-        st.error("Failed to decode JSON from Gemini response. Please check the response format.")
-        st.write("Raw Gemini response:", response.text if 'response' in locals() else "No response object")
+
+        result = orjson.loads(json_text)
+        events.put(("progress", label, f"{label}: done."))
+        return result
+    except orjson.JSONDecodeError:
+        # A truncated stream ends up here as well
+        events.put(("error", "Failed to decode JSON from Gemini response. Please check the response format.",
+                    "Raw Gemini response:", "".join(chunks) if chunks else "No response object"))
         return {}
     except Exception as e:
-        st.error(f"An error occurred with the Gemini API: {e}")
         # It's helpful to see the raw response when debugging
-        if 'response' in locals():
-            st.write("Raw Gemini response for debugging:", response.text)
+        events.put(("error", f"An error occurred with the Gemini API: {e}",
+                    "Raw Gemini response for debugging:" if chunks else None, "".join(chunks)))
         return {}
 
+async def analyze_docs(requests, events):
+    # Independent requests run concurrently so the network round-trips overlap
+    results = await asyncio.gather(*(analyze_doc(model, payload, label, events) for label, model, payload in requests))
+    analysis = {}
+    for result in results:
+        analysis.update(result)
+    return analysis
+
+def get_gemini_response(payloads):
+    # `payloads` maps a progress label to the payload of one Gemini request
+    events = queue.Queue()
+    errors = []
+    # Models are resolved here, on the script thread, where st.cache_resource has its context
+    requests = [(label, get_gemini_model(get_model_name(payload)), payload) for label, payload in payloads.items()]
+    future = asyncio.run_coroutine_threadsafe(analyze_docs(requests, events), get_event_loop())
+    with st.status("Waiting for Gemini...") as status:
+        progress = {label: status.empty() for label in payloads}
+        # Every event is queued before the future completes, so this drains them all
+        while not future.done() or not events.empty():
+            try:
+                event = events.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if event[0] == "progress":
+                progress[event[1]].write(event[2])
+            else:
+                errors.append(event[1:])
+        result = future.result()
+        status.update(label="Gemini response received.", state="complete", expanded=False)
+    for message, raw_caption, raw_text in errors:
+        st.error(message)
+        if raw_caption:
+            st.write(raw_caption, raw_text)
+    return result
+
+# --- Response Cache ---
+@st.cache_resource
+def get_response_cache():
+    return diskcache.Cache(RESPONSE_CACHE_DIR)
+
+def get_document_key(invoice_bytes, po_bytes):
+    # Hash incrementally rather than concatenating both uploads into yet another copy
+    hasher = hashlib.blake2b()
+    for part in (invoice_bytes, b"|", po_bytes, b"|", PROMPT_VERSION):
+        hasher.update(part)
+    return hasher.hexdigest()
+
+@st.cache_resource
+def get_embedding_model():
+    # st.cache_resource doesn't cache exceptions, so a failed load is cached as None instead;
+    # otherwise an offline host would retry the Hub download (and wait out its timeout) every analysis
+    try:
+        return SentenceTransformer(EMBEDDING_MODEL)
+    except Exception as e:
+        print(f"Embedding model unavailable, semantic cache disabled: {e}")
+        return None
+
+@st.cache_resource
+def get_semantic_cache():
+    # Shared across sessions: invoice embeddings in an inner-product index; each row id maps to the
+    # PO embedding and the result as orjson bytes (decoding gives each hit its own copy)
+    dimension = get_embedding_model().get_sentence_embedding_dimension()
+    return {"index": faiss.IndexFlatIP(dimension), "entries": [], "lock": threading.Lock()}
+
+def embed_texts(invoice_text, po_text):
+    model = get_embedding_model()
+    if model is None:
+        return None
+    # Embedded separately: the model truncates its input, so a joined text would barely cover the PO
+    vectors = model.encode([invoice_text, po_text], normalize_embeddings=True).astype("float32")
+    return vectors[0:1], vectors[1:2]
+
+_AMOUNT_RE = re.compile(r'\d[\d,]*(?:\.\d+)?')
+
+def _amounts_in_text(text):
+    return {round(float(amount.replace(',', '')), 2) for amount in _AMOUNT_RE.findall(text)}
+
+def _amount(value):
+    return round(float(str(value).replace(',', '')), 2)
+
+def _matches_text(data, number_field, text):
+    # The embeddings only see the start of each document, so a reused result must be fully
+    # confirmed by this document's text: number, vendor, date, total and every line item
+    text = " ".join(text.split())
+    for field in (number_field, 'vendor', 'date'):
+        value = " ".join(str(data.get(field) or '').split())
+        if not value or value not in text:
+            return False
+    amounts = _amounts_in_text(text)
+    try:
+        if _amount(data.get('total')) not in amounts:
+            return False
+        for item in data.get('items') or []:
+            description = " ".join(str(item.get('description') or '').split())
+            if not description or description not in text:
+                return False
+            if _amount(item.get('price')) not in amounts or _amount(item.get('quantity')) not in amounts:
+                return False
+    except (AttributeError, TypeError, ValueError):
+        return False
+    return True
+
+def semantic_cache_lookup(invoice_vector, po_vector, invoice_text, po_text):
+    cache = get_semantic_cache()
+    with cache["lock"]:
+        if cache["index"].ntotal == 0:
+            return None
+        scores, ids = cache["index"].search(invoice_vector, SEMANTIC_CACHE_CANDIDATES)
+        candidates = [cache["entries"][row] for score, row in zip(scores[0], ids[0]) if row >= 0 and score >= SEMANTIC_CACHE_THRESHOLD]
+    for cached_po_vector, result in candidates:
+        if float(cached_po_vector[0] @ po_vector[0]) < SEMANTIC_CACHE_THRESHOLD:
+            continue
+        analysis = orjson.loads(result)
+        if (_matches_text(analysis.get('invoice_data', {}), 'invoice_no', invoice_text)
+                and _matches_text(analysis.get('po_data', {}), 'po_no', po_text)):
+            return analysis
+    return None
+
+def semantic_cache_add(invoice_vector, po_vector, analysis):
+    cache = get_semantic_cache()
+    with cache["lock"]:
+        cache["index"].add(invoice_vector)
+        cache["entries"].append((po_vector, orjson.dumps(analysis)))
+
+def analyze_with_cache(document_key, payloads, invoice_text=None, po_text=None):
+    # Not an st.cache_data function: a Gemini call draws status/error UI, which Streamlit would
+    # replay on every in-memory hit. diskcache already returns a fresh copy per hit.
+    model_names = tuple(get_model_name(payload) for payload in payloads.values())
+    disk_cache = get_response_cache()
+    cache_key = (document_key, model_names)
+    analysis = disk_cache.get(cache_key)
+    if analysis is not None:
+        return analysis
+
+    # Near-duplicate documents can only be detected on the text path
+    vectors = None
+    if invoice_text and po_text:
+        try:
+            vectors = embed_texts(invoice_text, po_text)
+            analysis = semantic_cache_lookup(*vectors, invoice_text, po_text) if vectors is not None else None
+            if analysis is not None:
+                return analysis
+        except Exception as e:
+            # The semantic cache is only an optimization (the model may not even download); fall through to Gemini
+            print(f"Semantic cache lookup failed: {e}")
+            vectors = None
+
+    analysis = get_gemini_response(payloads)
+    # Failed or partial analyses are never cached
+    if analysis.get('invoice_data') and analysis.get('po_data'):
+        disk_cache.set(cache_key, analysis, expire=RESPONSE_CACHE_TTL)
+        if vectors is not None:
+            try:
+                semantic_cache_add(*vectors, analysis)
+            except Exception as e:
+                print(f"Semantic cache update failed: {e}")
+    return analysis
+
 # --- Helpers ---
-def get_text_with_pdfplumber(file):
+# A first page with less text than this is treated as a scan
+SCANNED_PDF_MIN_CHARS = 20
+PDF_TEXT_CACHE_DIR = os.path.join(CACHE_DIR, "pdftext")
+PDF_TEXT_CACHE_TTL = 7 * 86400
+PDF_TEXT_CACHE_SIZE_LIMIT = 1 << 30
+LLM_IMAGE_DPI = 200
+PREVIEW_IMAGE_DPI = 96
+# Decoded renders are large (~11 MB per 200 DPI A4 page), so keep only a bounded, short-lived set
+IMAGE_CACHE_MAX_ENTRIES = 32
+IMAGE_CACHE_TTL = 3600
+# Longest side of each page sent to Gemini; larger renders only add upload size and input tokens
+LLM_IMAGE_MAX_SIZE = 1568
+LLM_IMAGE_JPEG_QUALITY = 85
+COMPOSITE_GAP = 20
+COMPOSITE_LABEL_HEIGHT = 48
+ITEMS_PAGE_SIZE = 25
+
+@st.cache_resource
+def get_pdf_text_cache():
+    return diskcache.Cache(PDF_TEXT_CACHE_DIR, size_limit=PDF_TEXT_CACHE_SIZE_LIMIT, eviction_policy="least-recently-used")
+
+def cached_by_hash(func):
+    # Persists text extraction results on disk, keyed by extractor and SHA-1 of the file bytes
+    @functools.wraps(func)
+    def wrapper(file_bytes):
+        cache = get_pdf_text_cache()
+        key = (func.__name__, hashlib.sha1(file_bytes).hexdigest())
+        text = cache.get(key)
+        if text is None:
+            text = func(file_bytes)
+            # Extractors return "" on any failure, so an empty result may be transient and isn't cached
+            if text:
+                cache.set(key, text, expire=PDF_TEXT_CACHE_TTL)
+        return text
+    return wrapper
+
+@cached_by_hash
+def get_text_with_pdfplumber(file_bytes):
     try:
-        with pdfplumber.open(file) as pdf:
-            text = "\n".join([page.extract_text() for page in pdf.pages if page.extract_text()])
+        with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
+            # Serial on purpose: pages share one lazily-parsed pdfminer document, which isn't thread-safe
+            page_texts = [page.extract_text() or "" for page in pdf.pages]
+            text = "\n".join([page_text for page_text in page_texts if page_text])
         return text.strip()
     except Exception as e:
         print(f"pdfplumber failed: {e}")
         return ""
 
-def prepare_image(file):
-    if not file.name.lower().endswith('.pdf'):
-        return Image.open(file)
+@cached_by_hash
+def get_text_with_pymupdf(file_bytes):
     try:
-        doc = fitz.open(stream=file.read(), filetype="pdf")
+        doc = fitz.open(stream=file_bytes, filetype="pdf")
+        text = "\n".join(page.get_text("text") for page in doc)
+        doc.close()
+        return text.strip()
+    except Exception as e:
+        print(f"PyMuPDF failed: {e}")
+        return ""
+
+def is_scanned_pdf(file_bytes):
+    # Cheap probe of the first page so scans skip the slow extractors entirely
+    try:
+        with fitz.open(stream=file_bytes, filetype="pdf") as doc:
+            return len(doc[0].get_text("text").strip()) < SCANNED_PDF_MIN_CHARS
+    except Exception as e:
+        print(f"Scanned PDF probe failed: {e}")
+        return False
+
+def get_document_text(file_bytes, is_pdf):
+    if not is_pdf or is_scanned_pdf(file_bytes):
+        return ""
+    # PyMuPDF is much faster; pdfplumber only handles the streams it can't decode
+    text = get_text_with_pymupdf(file_bytes)
+    if not text:
+        text = get_text_with_pdfplumber(file_bytes)
+    return text
+
+@st.cache_data(ttl=IMAGE_CACHE_TTL, max_entries=IMAGE_CACHE_MAX_ENTRIES, show_spinner=False)
+def _render_image(file_key, dpi, is_pdf, _file_bytes):
+    # Cached on the content hash and DPI; the raw bytes are not re-hashed by Streamlit
+    if not is_pdf:
+        return Image.open(io.BytesIO(_file_bytes))
+    try:
+        doc = fitz.open(stream=_file_bytes, filetype="pdf")
         page = doc.load_page(0)
-        pix = page.get_pixmap(dpi=300)
-        img_data = pix.tobytes("png")
+        # Render straight to RGB samples; a PNG encode/decode round-trip only to hand it to PIL is wasted work
+        zoom = dpi / 72
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        image = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
         doc.close()
-        return Image.open(io.BytesIO(img_data))
+        return image
     except Exception as e:
         st.error(f"Failed to convert PDF to image: {e}")
         st.stop()
 
-def create_pdf(json_data):
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_font("Arial", size = 12)
-    pdf.multi_cell(0, 10, txt = json.dumps(json_data, indent=4))
-    return pdf.output(dest='S').encode('latin-1')
+def prepare_image(file_bytes, dpi, is_pdf):
+    return _render_image(hashlib.sha1(file_bytes).hexdigest(), dpi, is_pdf, file_bytes)
+
+def _downscale_for_llm(image):
+    # LLM_IMAGE_MAX_SIZE is a per-page budget: scans need the resolution for small line-item print,
+    # so the side-by-side composite may end up about twice as wide
+    image = image.convert("RGB")
+    image.thumbnail((LLM_IMAGE_MAX_SIZE, LLM_IMAGE_MAX_SIZE), Image.LANCZOS)
+    return image
+
+def prepare_composite_image_for_llm(invoice_image, po_image):
+    # Invoice on the left, PO on the right, so both go to Gemini as one image in one request
+    invoice_image = _downscale_for_llm(invoice_image)
+    po_image = _downscale_for_llm(po_image)
+    max_w = max(invoice_image.width, po_image.width)
+    max_h = max(invoice_image.height, po_image.height)
+    canvas = Image.new("RGB", (max_w * 2 + COMPOSITE_GAP, max_h + COMPOSITE_LABEL_HEIGHT), "white")
+    canvas.paste(invoice_image, (0, COMPOSITE_LABEL_HEIGHT))
+    canvas.paste(po_image, (max_w + COMPOSITE_GAP, COMPOSITE_LABEL_HEIGHT))
+    draw = ImageDraw.Draw(canvas)
+    font = ImageFont.load_default(size=COMPOSITE_LABEL_HEIGHT // 2)
+    draw.text((10, COMPOSITE_LABEL_HEIGHT // 4), "INVOICE", fill="black", font=font)
+    draw.text((max_w + COMPOSITE_GAP + 10, COMPOSITE_LABEL_HEIGHT // 4), "PO", fill="black", font=font)
+    buffer = io.BytesIO()
+    canvas.save(buffer, format="JPEG", quality=LLM_IMAGE_JPEG_QUALITY)
+    return {"mime_type": "image/jpeg", "data": buffer.getvalue()}
+
+def prepare_image_for_preview(file_bytes, is_pdf):
+    return prepare_image(file_bytes, PREVIEW_IMAGE_DPI, is_pdf)
 
 def editable_display_doc(title, data, doc_type):
     with st.container():
@@ -156,20 +463,47 @@ def editable_display_doc(title, data, doc_type):
         data['total'] = st.number_input("Total Amount", value=float(data.get('total', 0.0)), key=f"{doc_type}_total")
         
         with st.expander("View Itemized Details"):
-            items = data.get("items", [])
-            if items:
-                edited_items = st.data_editor(items, key=f"{doc_type}_items")
-                data['items'] = edited_items
-            else:
-                st.info("No items found.")
+            editable_items(data, doc_type)
     return data
 
+@st.fragment
+def editable_items(data, doc_type):
+    # Results only render on the "View Matching" run, so paging and edits must rerun just this
+    # fragment; edits are written into `data` in place, which is the dict held in session state
+    items = data.get("items", [])
+    if not items:
+        st.info("No items found.")
+        return
+    # Only the current page is handed to the editor so reruns don't re-render every row
+    page_count = math.ceil(len(items) / ITEMS_PAGE_SIZE)
+    page = 0
+    if page_count > 1:
+        page = st.number_input("Page", min_value=1, max_value=page_count, value=1, key=f"{doc_type}_items_page") - 1
+    start = page * ITEMS_PAGE_SIZE
+    end = start + ITEMS_PAGE_SIZE
+    edited_page = st.data_editor(items[start:end], key=f"{doc_type}_items_{page}")
+    data['items'] = items[:start] + list(edited_page) + items[end:]
+
+@st.fragment
+def document_preview(invoice_bytes, invoice_is_pdf, po_bytes, po_is_pdf):
+    # Toggling the preview reruns only this fragment, and nothing is rendered until it is shown;
+    # repeat renders are served by the _render_image cache
+    st.subheader("📄 Document Preview")
+    if not st.toggle("Show document preview", key="show_document_preview"):
+        return
+    doc_preview_tabs = st.tabs(["Invoice", "Purchase Order"])
+    with doc_preview_tabs[0]:
+        st.image(prepare_image_for_preview(invoice_bytes, invoice_is_pdf), use_container_width=True)
+    with doc_preview_tabs[1]:
+        st.image(prepare_image_for_preview(po_bytes, po_is_pdf), use_container_width=True)
+
 # --- Streamlit UI ---
 st.set_page_config(page_title="SMART-Match", layout="wide")
 
 # --- Style ---
-def load_css():
-    st.markdown("""
+@st.cache_resource
+def get_css_blob():
+    return """
     <style>
         @import url('https://fonts.googleapis.com/css2?family=Roboto:wght@400;700&display=swap');
         body {
@@ -227,7 +561,11 @@ def load_css():
             color: white !important;
         }
     </style>
-    """, unsafe_allow_html=True)
+    """
+
+def load_css():
+    # The page is rebuilt on every rerun, so the markdown call stays; only the string is cached
+    st.markdown(get_css_blob(), unsafe_allow_html=True)
 
 load_css()
 
@@ -254,23 +592,30 @@ if compare_button:
 
     with st.spinner("🤖 Analyzing documents..."):
         # --- Document Analysis ---
-        invoice_text = get_text_with_pdfplumber(invoice_file)
-        po_text = get_text_with_pdfplumber(po_file)
+        # Read each upload once; everything downstream works on the bytes
+        invoice_bytes = invoice_file.getvalue()
+        po_bytes = po_file.getvalue()
+        invoice_is_pdf = invoice_file.name.lower().endswith('.pdf')
+        po_is_pdf = po_file.name.lower().endswith('.pdf')
 
-        # Reset file pointers
-        invoice_file.seek(0)
-        po_file.seek(0)
+        document_key = get_document_key(invoice_bytes, po_bytes)
+        invoice_text = get_document_text(invoice_bytes, invoice_is_pdf)
+        # Both documents go to the image pipeline if either has no text, so don't extract the PO needlessly
+        po_text = get_document_text(po_bytes, po_is_pdf) if invoice_text else ""
 
         if invoice_text and po_text:
             st.info("✅ Using text-based extraction.")
-            payload = [TEXT_PROMPT, f"\n--- INVOICE TEXT ---\n{invoice_text}", f"\n--- PO TEXT ---\n{po_text}"]
-            analysis = get_gemini_response(payload)
+            invoice_payload = [INVOICE_TEXT_PROMPT, f"\n--- INVOICE TEXT ---\n{invoice_text}"]
+            po_payload = [PO_TEXT_PROMPT, f"\n--- PO TEXT ---\n{po_text}"]
+            analysis = analyze_with_cache(
+                document_key, {"Invoice": invoice_payload, "Purchase Order": po_payload}, invoice_text, po_text
+            )
         else:
             st.warning("⚠ Text extraction failed. Falling back to image-based analysis.")
-            invoice_image = prepare_image(invoice_file)
-            po_image = prepare_image(po_file)
-            payload = [IMAGE_PROMPT, invoice_image, po_image]
-            analysis = get_gemini_response(payload)
+            invoice_image = prepare_image(invoice_bytes, LLM_IMAGE_DPI, invoice_is_pdf)
+            po_image = prepare_image(po_bytes, LLM_IMAGE_DPI, po_is_pdf)
+            composite_image = prepare_composite_image_for_llm(invoice_image, po_image)
+            analysis = analyze_with_cache(document_key, {"Invoice & Purchase Order": [IMAGE_PROMPT, composite_image]})
 
     st.success("Analysis complete!")
 
@@ -293,7 +638,7 @@ if compare_button:
             st.session_state.po_data = st.session_state.edited_po_data
 
         match_status = "✅ APPROVED: Perfect Match!"
-        if not (st.session_state.invoice_data.get('vendor') == st.session_state.po_data.get('vendor') and abs(float(st.session_state.invoice_data.get('total', 0.0)) - float(st.session_state.po_data.get('total', 0.0))) < 0.01):
+        if not (vendors_match(st.session_state.invoice_data.get('vendor'), st.session_state.po_data.get('vendor')) and abs(float(st.session_state.invoice_data.get('total', 0.0)) - float(st.session_state.po_data.get('total', 0.0))) < 0.01):
             match_status = "⚠ NEEDS REVIEW: Discrepancies found."
         st.info(match_status)
 
@@ -320,9 +665,4 @@ if compare_button:
     st.divider()
     
     # --- Document Preview ---
-    st.subheader("📄 Document Preview")
-    doc_preview_tabs = st.tabs(["Invoice", "Purchase Order"])
-    with doc_preview_tabs[0]:
-        st.image(prepare_image(invoice_file), use_container_width=True)
-    with doc_preview_tabs[1]:
-        st.image(prepare_image(po_file), use_container_width=True)
+    document_preview(invoice_bytes, invoice_is_pdf, po_bytes, po_is_pdf)
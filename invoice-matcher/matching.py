@@ -0,0 +1,14 @@
+import re
+import unicodedata
+
+# Unicode-aware: drops punctuation, whitespace and underscores but keeps letters of any script
+_SEPARATORS_RE = re.compile(r'[\W_]+')
+
+def _norm(value):
+    # "ACME, Inc." and "ACME Inc" compare equal once case, width and punctuation are dropped
+    return _SEPARATORS_RE.sub('', unicodedata.normalize('NFKC', str(value or '')).casefold())
+
+def vendors_match(invoice_vendor, po_vendor):
+    # A name that normalizes to nothing can't confirm a match
+    invoice_name = _norm(invoice_vendor)
+    return bool(invoice_name) and invoice_name == _norm(po_vendor)
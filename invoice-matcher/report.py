@@ -0,0 +1,50 @@
+import html
+import io
+
+import fitz # PyMuPDF
+import orjson
+
+PDF_FONT_SIZE = 10
+PDF_MARGIN = 72
+
+def _iter_json_lines(json_data):
+    # Serialize one top-level subtree at a time instead of one big dump string
+    if not isinstance(json_data, dict) or not json_data:
+        yield from orjson.dumps(json_data, option=orjson.OPT_INDENT_2).decode().splitlines()
+        return
+    yield "{"
+    last_index = len(json_data) - 1
+    for index, (key, value) in enumerate(json_data.items()):
+        lines = orjson.dumps(value, option=orjson.OPT_INDENT_2).decode().splitlines()
+        lines[0] = f"{orjson.dumps(key).decode()}: {lines[0]}"
+        if index != last_index:
+            lines[-1] += ","
+        for line in lines:
+            yield f"  {line}"
+    yield "}"
+
+def create_pdf(json_data):
+    # A Story lets MuPDF wrap the text and pick a fallback font per script (₹, Thai, Hebrew, CJK, ...)
+    body = "\n".join(html.escape(line) for line in _iter_json_lines(json_data))
+    story = fitz.Story(html=f'<pre style="white-space: pre-wrap; font-size: {PDF_FONT_SIZE}px">{body}</pre>')
+    page_rect = fitz.paper_rect("a4")
+    content_rect = page_rect + (PDF_MARGIN, PDF_MARGIN, -PDF_MARGIN, -PDF_MARGIN)
+    buffer = io.BytesIO()
+    writer = fitz.DocumentWriter(buffer)
+    more = True
+    while more:
+        device = writer.begin_page(page_rect)
+        more, _ = story.place(content_rect)
+        story.draw(device)
+        writer.end_page()
+    writer.close()
+
+    doc = fitz.open(stream=buffer.getvalue(), filetype="pdf")
+    try:
+        # Only keep the glyphs actually used; the fallback fonts are several MB
+        doc.subset_fonts()
+    except Exception as e:
+        print(f"Font subsetting failed: {e}")
+    pdf_bytes = doc.tobytes(garbage=3, deflate=True)
+    doc.close()
+    return pdf_bytes
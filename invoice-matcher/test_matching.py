@@ -0,0 +1,17 @@
+from matching import _norm, vendors_match
+
+
+def test_punctuation_and_case_are_ignored():
+    assert vendors_match("ACME, Inc.", "acme inc")
+
+
+def test_non_latin_vendors_are_distinguished():
+    assert not vendors_match("ООО Ромашка", "ООО Лютик")
+    assert not vendors_match("Müller GmbH", "Möller GmbH")
+    assert _norm("株式会社") == "株式会社"
+
+
+def test_empty_names_do_not_match():
+    assert not vendors_match("", "")
+    assert not vendors_match(None, None)
+    assert not vendors_match("...", "---")
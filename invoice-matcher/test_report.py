@@ -0,0 +1,26 @@
+import fitz
+
+from report import create_pdf
+
+
+def _pdf_text(pdf_bytes):
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        return "".join(page.get_text() for page in doc)
+
+
+def test_non_latin_values_round_trip():
+    text = _pdf_text(create_pdf({"invoice_data": {"vendor": "Tata ₹ Ltd", "total": "₹1,200", "note": "ขอบคุณ"}}))
+    assert "Tata ₹ Ltd" in text
+    assert "₹1,200" in text
+    assert "ขอบคุณ" in text
+    assert "\x00" not in text
+
+
+def test_long_results_span_pages():
+    items = [{"description": f"Item {i}", "quantity": i, "price": 1.5} for i in range(200)]
+    with fitz.open(stream=create_pdf({"invoice_data": {"items": items}}), filetype="pdf") as doc:
+        assert doc.page_count > 1
+
+
+def test_angle_brackets_are_escaped():
+    assert "<b>ACME</b>" in _pdf_text(create_pdf({"vendor": "<b>ACME</b>"}))